@@ -1,77 +1,118 @@
 # Imports
+import asyncio
+import atexit
 import httpx
 import logging
+import logging.handlers
 import os
+import queue
+from contextlib import asynccontextmanager
 from fastmcp import FastMCP
+from src.config import Config
 from src.pcloudy_api import PCloudyAPI
 from src.mcp_tools import (
     list_available_devices,
     book_device_by_name,
     upload_file,
     execute_adb_command,
+    execute_adb_batch,
     capture_device_screenshot,
     install_and_launch_app,
     release_device,
     get_device_page_url
 )
 
-# Configure logging with more detailed format and file output
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("pcloudy_server.log", mode='a', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
+# Configure logging; file and console I/O run on a background listener thread
+log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+file_handler = logging.handlers.RotatingFileHandler(
+    "pcloudy_server.log", mode='a', maxBytes=10 * 1024 * 1024, backupCount=3, encoding='utf-8'
 )
+stream_handler = logging.StreamHandler()
+for handler in (file_handler, stream_handler):
+    handler.setFormatter(log_formatter)
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler)
+log_level = os.environ.get("LOG_LEVEL", "INFO").upper()
+invalid_log_level = log_level not in logging.getLevelNamesMapping()
+root_logger = logging.getLogger()
+root_logger.setLevel("INFO" if invalid_log_level else log_level)
+root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger("pcloudy-mcp-server")
+if invalid_log_level:
+    logger.warning(f"Unknown LOG_LEVEL '{log_level}', falling back to INFO")
+Config.log_settings()
 
-# Initialize MCP server
-mcp = FastMCP("pcloudy_MCP", description="MCP server for pCloudy Android device management")
+# Cap concurrent tool calls so a burst from the client cannot flood the pCloudy API
+TOOL_SEMAPHORE = asyncio.Semaphore(int(os.environ.get("MAX_CONCURRENT_TOOLS", "8")))
 
 # Initialize PCloudyAPI instance
 api = PCloudyAPI()
 
+@asynccontextmanager
+async def lifespan(server):
+    """Close the pCloudy HTTP client and token refresher when the server shuts down."""
+    async with api:
+        yield
+
+# Initialize MCP server
+mcp = FastMCP("pcloudy_MCP", description="MCP server for pCloudy Android device management", lifespan=lifespan)
+
 # Register tools
 @mcp.tool()
 async def list_available_devices_tool() -> dict:
     """List the names of available Android devices."""
-    return await list_available_devices(api)
+    async with TOOL_SEMAPHORE:
+        return await list_available_devices(api)
 
 @mcp.tool()
 async def book_device_by_name_tool(device_name: str) -> dict:
     """Book an Android device by matching the provided device name from the available list."""
-    return await book_device_by_name(api, device_name)
+    async with TOOL_SEMAPHORE:
+        return await book_device_by_name(api, device_name)
 
 @mcp.tool()
 async def upload_file_tool(file_path: str, source_type: str = "raw", filter_type: str = "all") -> dict:
     """Upload a file to the pCloudy cloud drive, but only if it does not already exist."""
-    return await upload_file(api, file_path, source_type, filter_type)
+    async with TOOL_SEMAPHORE:
+        return await upload_file(api, file_path, source_type, filter_type)
 
 @mcp.tool()
 async def execute_adb_command_tool(rid: str, adb_command: str) -> dict:
     """Execute an ADB command on a booked device."""
-    return await execute_adb_command(api, rid, adb_command)
+    async with TOOL_SEMAPHORE:
+        return await execute_adb_command(api, rid, adb_command)
+
+@mcp.tool()
+async def execute_adb_batch_tool(rids_and_commands: list[tuple[str, str]]) -> dict:
+    """Execute ADB commands on several booked devices concurrently, given (rid, adb_command) pairs."""
+    async with TOOL_SEMAPHORE:
+        return await execute_adb_batch(api, rids_and_commands)
 
 @mcp.tool()
 async def capture_device_screenshot_tool(rid: str, skin: bool = True) -> dict:
     """Capture a screenshot of a booked device."""
-    return await capture_device_screenshot(api, rid, skin)
+    async with TOOL_SEMAPHORE:
+        return await capture_device_screenshot(api, rid, skin)
 
 @mcp.tool()
 async def install_and_launch_app_tool(rid: str, filename: str, grant_all_permissions: bool = True) -> dict:
     """Install and launch an app on a booked device."""
-    return await install_and_launch_app(api, rid, filename, grant_all_permissions)
+    async with TOOL_SEMAPHORE:
+        return await install_and_launch_app(api, rid, filename, grant_all_permissions)
 
 @mcp.tool()
 async def release_device_tool(rid: str) -> dict:
     """Release a booked device."""
-    return await release_device(api, rid)
+    async with TOOL_SEMAPHORE:
+        return await release_device(api, rid)
 
 @mcp.tool()
 async def get_device_page_url_tool(rid: str) -> dict:
     """Get the pCloudy device page URL to view the device screen."""
-    return await get_device_page_url(api, rid)
+    async with TOOL_SEMAPHORE:
+        return await get_device_page_url(api, rid)
 
 # Add this block at the end of the file
 if __name__ == "__main__":
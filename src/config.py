@@ -1,18 +1,33 @@
+import logging
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger("pcloudy-mcp-server")
+
 class Config:
     PCLOUDY_BASE_URL = "https://device.pcloudy.com/api"
     DEFAULT_PLATFORM = "android"
     DEFAULT_DURATION = 10
     REQUEST_TIMEOUT = 300  # seconds
+    MAX_CONNECTIONS = 50
+    MAX_KEEPALIVE_CONNECTIONS = 20
+    KEEPALIVE_EXPIRY = 60.0  # seconds
     TOKEN_REFRESH_THRESHOLD = 3600 # seconds (1 hour)
+    TOKEN_REFRESH_MARGIN = 60  # seconds before expiry to refresh in the background
+    TOKEN_REFRESH_RETRY_DELAY = 10  # seconds between failed background refresh attempts
+    DEVICES_CACHE_TTL = 15  # seconds
+    CLOUD_FILES_CACHE_TTL = 15  # seconds
+    BATCH_CONCURRENCY = 10  # max in-flight requests across all batch tool calls
 
     # Retrieve environment variables
     USERNAME = os.environ.get("PCLOUDY_USERNAME")
     API_KEY = os.environ.get("PCLOUDY_API_KEY")
 
-    print(f"DEBUG: Inside Config class definition - PCLOUDY_USERNAME: {USERNAME}")
-    print(f"DEBUG: Inside Config class definition - PCLOUDY_API_KEY: {API_KEY}")
\ No newline at end of file
+    @classmethod
+    def log_settings(cls):
+        """Log which credentials were loaded when PCLOUDY_DEBUG is set (the API key is never logged)."""
+        if os.environ.get("PCLOUDY_DEBUG"):
+            logger.debug(f"Config - PCLOUDY_USERNAME: {cls.USERNAME}")
+            logger.debug(f"Config - PCLOUDY_API_KEY set: {bool(cls.API_KEY)}")
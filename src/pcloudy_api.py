@@ -1,41 +1,92 @@
+import asyncio
+import contextvars
 import httpx
-import base64
-import json
 import logging
+import orjson
 import time
 import os
+from contextlib import asynccontextmanager
 from typing import Dict, Any
 from .config import Config
-from .utils import encode_auth, parse_response
+from .utils import encode_auth, parse_response, stream_multipart
 
 logger = logging.getLogger("pcloudy-mcp-server")
 
+# Shared across PCloudyAPI instances so pooled keep-alive connections are reused
+_client = None
+
+def get_client():
+    """Return the shared pCloudy HTTP client, creating it if needed."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=Config.REQUEST_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=Config.MAX_CONNECTIONS,
+                max_keepalive_connections=Config.MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=Config.KEEPALIVE_EXPIRY
+            ),
+            http2=True
+        )
+    return _client
+
+# Set to the PCloudyAPI whose token the current task has already validated; a
+# context variable keeps concurrent tool calls from skipping each other's checks
+_token_validated_for = contextvars.ContextVar("token_validated_for", default=None)
+
 class PCloudyAPI:
     def __init__(self, username=None, api_key=None, base_url=None):
         self.username = username or Config.USERNAME
         self.api_key = api_key or Config.API_KEY
         self.base_url = base_url or Config.PCLOUDY_BASE_URL
+        # Credentials are fixed for the lifetime of the instance
+        self._basic_auth_header = f"Basic {encode_auth(self.username, self.api_key)}"
         self.auth_token = None
-        self.token_timestamp = None
-        self.client = httpx.Client(timeout=Config.REQUEST_TIMEOUT)
+        self._token_deadline = 0.0
         self.rid = None
+        self._auth_lock = asyncio.Lock()
+        self._refresh_task = None
+        self._devices_cache = None  # (timestamp, request args, result)
+        self._devices_generation = 0  # bumped on every invalidation
+        self._devices_lock = asyncio.Lock()
+        self._cloud_files_cache = None  # (timestamp, file names)
+        self._active_contexts = 0
+        # Shared by all batch calls so concurrent batches cannot multiply the fan-out
+        self._batch_semaphore = asyncio.Semaphore(Config.BATCH_CONCURRENCY)
         logger.info("PCloudyAPI initialized")
 
-    def authenticate(self):
+    @property
+    def client(self):
+        return get_client()
+
+    async def __aenter__(self):
+        self._active_contexts += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        # The server's lifespan may be entered once per client session, so only
+        # close once the last one has exited
+        self._active_contexts -= 1
+        if self._active_contexts == 0:
+            await self.aclose()
+
+    async def authenticate(self):
         try:
             logger.info("Authenticating with pCloudy")
             url = f"{self.base_url}/access"
-            auth = encode_auth(self.username, self.api_key)
-            headers = {"Authorization": f"Basic {auth}"}
-            response = self.client.get(url, headers=headers)
+            headers = {"Authorization": self._basic_auth_header}
+            response = await self.client.get(url, headers=headers)
             response.raise_for_status()
             result = parse_response(response)
-            self.auth_token = result.get("token")
-            if not self.auth_token:
+            token = result.get("token")
+            if not token:
                 logger.error("Authentication failed: No token received")
                 raise ValueError("Authentication failed: No token received")
-            self.token_timestamp = time.time()
+            self.auth_token = token
+            self._token_deadline = time.monotonic() + Config.TOKEN_REFRESH_THRESHOLD
             logger.info("Authentication successful")
+            if self._refresh_task is None or self._refresh_task.done():
+                self._refresh_task = asyncio.create_task(self._token_refresher())
             return self.auth_token
         except httpx.RequestError as e:
             logger.error(f"Authentication request failed: {str(e)}")
@@ -44,18 +95,102 @@ class PCloudyAPI:
             logger.error(f"Authentication error: {str(e)}")
             raise
 
-    def check_token_validity(self):
-        if not self.auth_token:
-            logger.info("No authentication token present, authenticating...")
-            return self.authenticate()
-        if self.token_timestamp and (time.time() - self.token_timestamp) > Config.TOKEN_REFRESH_THRESHOLD:
-            logger.info("Token expired, refreshing...")
-            return self.authenticate()
-        return self.auth_token
+    async def _token_refresher(self):
+        """Re-authenticate shortly before the token expires so requests never wait on it."""
+        delay = max(Config.TOKEN_REFRESH_THRESHOLD - Config.TOKEN_REFRESH_MARGIN, 0)
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                logger.info("Refreshing token in the background...")
+                async with self._auth_lock:
+                    await self.authenticate()
+                delay = max(Config.TOKEN_REFRESH_THRESHOLD - Config.TOKEN_REFRESH_MARGIN, 0)
+            except Exception as e:
+                # Keep the current token; it stays usable until its deadline, after
+                # which check_token_validity re-authenticates inline
+                logger.error(f"Background token refresh failed, retrying in {Config.TOKEN_REFRESH_RETRY_DELAY}s: {str(e)}")
+                delay = Config.TOKEN_REFRESH_RETRY_DELAY
+
+    @asynccontextmanager
+    async def _with_valid_token(self):
+        """Validate the token once for a compound operation.
+
+        check_token_validity calls made inside the block, including from tasks it
+        spawns, return the token without re-checking it.
+        """
+        if _token_validated_for.get() is self:
+            yield self.auth_token
+            return
+        await self.check_token_validity()
+        reset = _token_validated_for.set(self)
+        try:
+            yield self.auth_token
+        finally:
+            _token_validated_for.reset(reset)
+
+    async def check_token_validity(self):
+        if _token_validated_for.get() is self:
+            return self.auth_token
+        # The background refresher normally keeps the deadline ahead of us; the
+        # deadline still guards against a token outliving a stalled refresher
+        if self.auth_token and time.monotonic() < self._token_deadline:
+            return self.auth_token
+        # Concurrent callers share one authentication round-trip
+        async with self._auth_lock:
+            if not self.auth_token:
+                logger.info("No authentication token present, authenticating...")
+                return await self.authenticate()
+            if time.monotonic() >= self._token_deadline:
+                logger.info("Token expired, refreshing...")
+                return await self.authenticate()
+            return self.auth_token
+
+    def _invalidate_devices_cache(self):
+        self._devices_cache = None
+        # Stops a listing that was already in flight from storing its stale result
+        self._devices_generation += 1
+
+    def _cached_devices(self, key):
+        if self._devices_cache is None:
+            return None
+        timestamp, cached_key, result = self._devices_cache
+        if cached_key != key or (time.time() - timestamp) >= Config.DEVICES_CACHE_TTL:
+            return None
+        return result
+
+    async def get_devices_list(self, platform=Config.DEFAULT_PLATFORM, duration=Config.DEFAULT_DURATION, available_now=True):
+        key = (platform, duration, available_now)
+        result = self._cached_devices(key)
+        if result is not None:
+            logger.info("Using cached device list")
+            return result
+        # Concurrent callers wait for the in-flight request instead of issuing their own
+        async with self._devices_lock:
+            result = self._cached_devices(key)
+            if result is not None:
+                logger.info("Using cached device list")
+                return result
+            generation = self._devices_generation
+            result = await self._fetch_devices_list(platform, duration, available_now)
+            # Lowercase model names and index available devices once here rather
+            # than on every lookup by the tools
+            available_devices = []
+            available_by_name = {}
+            for device in result.get("models", []):
+                device["model_lower"] = device["model"].lower()
+                if device["available"]:
+                    available_devices.append(device)
+                    # First match wins, as in the substring scan
+                    available_by_name.setdefault(device["model_lower"], device)
+            result["available_devices"] = available_devices
+            result["available_by_name"] = available_by_name
+            if generation == self._devices_generation:
+                self._devices_cache = (time.time(), key, result)
+            return result
 
-    def get_devices_list(self, platform=Config.DEFAULT_PLATFORM, duration=Config.DEFAULT_DURATION, available_now=True):
+    async def _fetch_devices_list(self, platform, duration, available_now):
         try:
-            self.check_token_validity()
+            await self.check_token_validity()
             logger.info(f"Getting device list for platform {platform}")
             url = f"{self.base_url}/devices"
             payload = {
@@ -65,7 +200,7 @@ class PCloudyAPI:
                 "available_now": str(available_now).lower()
             }
             headers = {"Content-Type": "application/json"}
-            response = self.client.post(url, json=payload, headers=headers)
+            response = await self.client.post(url, json=payload, headers=headers)
             response.raise_for_status()
             result = parse_response(response)
             logger.info(f"Retrieved {len(result.get('models', []))} devices")
@@ -77,9 +212,9 @@ class PCloudyAPI:
             logger.error(f"Error getting device list: {str(e)}")
             raise
 
-    def book_device(self, device_id, duration=Config.DEFAULT_DURATION):
+    async def book_device(self, device_id, duration=Config.DEFAULT_DURATION):
         try:
-            self.check_token_validity()
+            await self.check_token_validity()
             logger.info(f"Booking device with ID {device_id}")
             url = f"{self.base_url}/book_device"
             payload = {
@@ -88,9 +223,11 @@ class PCloudyAPI:
                 "duration": duration
             }
             headers = {"Content-Type": "application/json"}
-            response = self.client.post(url, json=payload, headers=headers)
+            response = await self.client.post(url, json=payload, headers=headers)
             response.raise_for_status()
             result = parse_response(response)
+            # Availability has changed, so the cached device list is stale
+            self._invalidate_devices_cache()
             logger.info(f"Device booked successfully. RID: {result.get('rid')}")
             return result
         except httpx.RequestError as e:
@@ -100,65 +237,84 @@ class PCloudyAPI:
             logger.error(f"Error booking device: {str(e)}")
             raise
 
-    def list_cloud_files(self):
-        """List files in the user's pCloudy cloud drive."""
+    async def list_cloud_files(self):
+        """Return the set of file names in the user's pCloudy cloud drive."""
+        if self._cloud_files_cache is not None:
+            timestamp, names = self._cloud_files_cache
+            if (time.time() - timestamp) < Config.CLOUD_FILES_CACHE_TTL:
+                logger.info("Using cached cloud file list")
+                return names
         try:
-            self.check_token_validity()
+            await self.check_token_validity()
             url = f"{self.base_url}/content"
             params = {"token": self.auth_token}
-            response = self.client.get(url, params=params)
+            response = await self.client.get(url, params=params)
             response.raise_for_status()
             result = parse_response(response)
             # result is expected to be a list of dicts with 'name' key
-            return [f["name"] for f in result.get("files", [])] if isinstance(result, dict) else []
+            names = frozenset(f["name"] for f in result.get("files", [])) if isinstance(result, dict) else frozenset()
+            self._cloud_files_cache = (time.time(), names)
+            return names
         except Exception as e:
             logger.error(f"Error listing cloud files: {str(e)}")
-            return []
+            return frozenset()
 
-    def upload_file(self, file_path, source_type="raw", filter_type="all"):
+    async def upload_file(self, file_path, source_type="raw", filter_type="all"):
         try:
             file_path = file_path.strip('"').strip("'")  # Remove quotes if present
-            self.check_token_validity()
             logger.info(f"Uploading file: {file_path}")
-            if not os.path.isfile(file_path):
+            # Filesystem calls, including the reads while streaming the upload, run in
+            # a worker thread so slow disks don't stall the event loop
+            if not await asyncio.to_thread(os.path.isfile, file_path):
                 logger.error(f"Provided path is not a file: {file_path}")
                 return {
                     "content": [{"type": "text", "text": f"Provided path is not a file: {file_path}"}],
                     "isError": True
                 }
             file_name = os.path.basename(file_path)
-            # Check if file already exists in cloud drive
-            cloud_files = self.list_cloud_files()
-            if file_name in cloud_files:
-                logger.info(f"File '{file_name}' already exists in cloud drive")
-                return {
-                    "content": [{"type": "text", "text": f"File '{file_name}' already exists in your pCloudy cloud drive."}],
-                    "isError": False
+            # Validate the token once for the listing and the upload
+            async with self._with_valid_token():
+                # Check if file already exists in cloud drive
+                cloud_files = await self.list_cloud_files()
+                if file_name in cloud_files:
+                    logger.info(f"File '{file_name}' already exists in cloud drive")
+                    return {
+                        "content": [{"type": "text", "text": f"File '{file_name}' already exists in your pCloudy cloud drive."}],
+                        "isError": False
+                    }
+                url = f"{self.base_url}/upload_file"
+                data = {
+                    "source_type": source_type,
+                    "token": self.auth_token,
+                    "filter": filter_type
                 }
-            url = f"{self.base_url}/upload_file"
-            files = {"file": open(file_path, "rb")}
-            data = {
-                "source_type": source_type,
-                "token": self.auth_token,
-                "filter": filter_type
-            }
-            headers = {"Authorization": f"Basic {encode_auth(self.username, self.api_key)}"}
-            response = self.client.post(url, files=files, data=data, headers=headers)
-            response.raise_for_status()
-            result = parse_response(response)
-            file_name = result.get("file")
-            if not file_name:
-                logger.error("Failed to get uploaded file name")
-                logger.error(f"API response missing file: {result}")
+                # The body is streamed in chunks instead of reading the whole APK/IPA
+                # into memory; the handle is closed even if the request fails
+                with await asyncio.to_thread(open, file_path, "rb") as f:
+                    file_size = (await asyncio.to_thread(os.fstat, f.fileno())).st_size
+                    multipart_headers, body = stream_multipart(data, "file", file_name, f, file_size)
+                    headers = {"Authorization": self._basic_auth_header, **multipart_headers}
+                    response = await self.client.post(url, content=body, headers=headers)
+                response.raise_for_status()
+                result = parse_response(response)
+                uploaded_name = result.get("file")
+                if not uploaded_name:
+                    logger.error("Failed to get uploaded file name")
+                    logger.error(f"API response missing file: {result}")
+                    return {
+                        "content": [{"type": "text", "text": "Failed to get uploaded file name"}],
+                        "isError": True
+                    }
+                if self._cloud_files_cache is not None:
+                    # Keep the cached listing current so batch uploads skip a re-list;
+                    # record the local name since that is what the existence check uses
+                    timestamp, names = self._cloud_files_cache
+                    self._cloud_files_cache = (timestamp, names | {file_name})
+                logger.info(f"File '{uploaded_name}' uploaded successfully")
                 return {
-                    "content": [{"type": "text", "text": "Failed to get uploaded file name"}],
-                    "isError": True
+                    "content": [{"type": "text", "text": f"File '{uploaded_name}' uploaded successfully"}],
+                    "isError": False
                 }
-            logger.info(f"File '{file_name}' uploaded successfully")
-            return {
-                "content": [{"type": "text", "text": f"File '{file_name}' uploaded successfully"}],
-                "isError": False
-            }
         except httpx.RequestError as e:
             logger.error(f"File upload request failed: {str(e)}")
             raise
@@ -166,9 +322,9 @@ class PCloudyAPI:
             logger.error(f"Error uploading file: {str(e)}")
             raise
 
-    def execute_adb(self, rid, adb_command):
+    async def execute_adb(self, rid, adb_command):
         try:
-            self.check_token_validity()
+            await self.check_token_validity()
             logger.info(f"Executing ADB command: {adb_command} on RID: {rid}")
             url = f"{self.base_url}/execute_adb"
             payload = {
@@ -177,7 +333,7 @@ class PCloudyAPI:
                 "adbCommand": adb_command
             }
             headers = {"Content-Type": "application/json"}
-            response = self.client.post(url, json=payload, headers=headers)
+            response = await self.client.post(url, json=payload, headers=headers)
             response.raise_for_status()
             result = parse_response(response)
             logger.info(f"ADB command executed successfully: {result}")
@@ -189,9 +345,27 @@ class PCloudyAPI:
             logger.error(f"Error executing ADB command: {str(e)}")
             raise
 
-    def capture_screenshot(self, rid, skin=True):
+    async def execute_adb_batch(self, rids_and_commands):
+        """Execute ADB commands on several devices concurrently.
+
+        Takes a list of (rid, adb_command) pairs and returns one result per pair, in
+        order; a failed command yields its exception instead of aborting the batch.
+        """
+        logger.info(f"Executing ADB batch of {len(rids_and_commands)} commands")
+
+        async def _one(rid, adb_command):
+            async with self._batch_semaphore:
+                return await self.execute_adb(rid, adb_command)
+
+        async with self._with_valid_token():
+            return await asyncio.gather(
+                *[_one(rid, adb_command) for rid, adb_command in rids_and_commands],
+                return_exceptions=True
+            )
+
+    async def capture_screenshot(self, rid, skin=True):
         try:
-            self.check_token_validity()
+            await self.check_token_validity()
             logger.info(f"Capturing screenshot for RID: {rid}")
             url = f"{self.base_url}/capture_device_screenshot"
             payload = {
@@ -200,9 +374,10 @@ class PCloudyAPI:
                 "skin": str(skin).lower()
             }
             headers = {"Content-Type": "application/json"}
-            response = self.client.post(url, json=payload, headers=headers)
+            response = await self.client.post(url, json=payload, headers=headers)
             response.raise_for_status()
-            logger.debug(f"Raw screenshot API response: {response.text}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Raw screenshot API response: {response.text}")
             result = parse_response(response)
             logger.info(f"Screenshot API response: {result}")
 
@@ -227,9 +402,9 @@ class PCloudyAPI:
             logger.error(f"Error capturing screenshot: {str(e)}")
             raise
 
-    def install_and_launch_app(self, rid, filename, grant_all_permissions=True):
+    async def install_and_launch_app(self, rid, filename, grant_all_permissions=True):
         try:
-            self.check_token_validity()
+            await self.check_token_validity()
             logger.info(f"Installing and launching app: {filename} on RID: {rid}")
             url = f"{self.base_url}/install_app"
             payload = {
@@ -239,7 +414,7 @@ class PCloudyAPI:
                 "grant_all_permissions": str(grant_all_permissions).lower()
             }
             headers = {"Content-Type": "application/json"}
-            response = self.client.post(url, json=payload, headers=headers)
+            response = await self.client.post(url, json=payload, headers=headers)
             response.raise_for_status()
             result = parse_response(response)
             logger.info(f"App '{filename}' installed and launched successfully: {result}")
@@ -251,9 +426,9 @@ class PCloudyAPI:
             logger.error(f"Error installing and launching app: {str(e)}")
             raise
 
-    def release_device(self, rid):
+    async def release_device(self, rid):
         try:
-            self.check_token_validity()
+            await self.check_token_validity()
             logger.info(f"Releasing device with RID: {rid}")
             url = f"{self.base_url}/release_device"
             payload = {
@@ -261,9 +436,11 @@ class PCloudyAPI:
                 "rid": rid
             }
             headers = {"Content-Type": "application/json"}
-            response = self.client.post(url, json=payload, headers=headers)
+            response = await self.client.post(url, json=payload, headers=headers)
             response.raise_for_status()
             result = parse_response(response)
+            # The released device is available again, so the cached device list is stale
+            self._invalidate_devices_cache()
             logger.info(f"Device with RID {rid} released successfully")
             return {
                 "content": [{"type": "text", "text": f"Device with RID {rid} released successfully"}],
@@ -279,10 +456,10 @@ class PCloudyAPI:
                 "isError": True
             }
 
-    def get_device_page_url(self, rid):
+    async def get_device_page_url(self, rid):
         """Return the pCloudy device page URL for a given RID using the API."""
         try:
-            self.check_token_validity()
+            await self.check_token_validity()
             logger.info(f"Getting device page URL for RID: {rid}")
             url = f"{self.base_url}/get_device_url"
             payload = {
@@ -290,9 +467,9 @@ class PCloudyAPI:
                 "rid": rid
             }
             headers = {"Content-Type": "application/json"}
-            response = self.client.post(url, json=payload, headers=headers)
+            response = await self.client.post(url, json=payload, headers=headers)
             response.raise_for_status()
-            data = response.json()
+            data = orjson.loads(response.content)
             # Expecting {"result":{"token":"...","code":200,"URL":"https://device.pcloudy.com/device/..."}} 
             result = data.get("result", {})
             device_url = result.get("URL")
@@ -314,8 +491,12 @@ class PCloudyAPI:
                 "isError": True
             }
 
-    def __del__(self):
-        try:
-            self.client.close()
-        except:
-            pass 
\ No newline at end of file
+    async def aclose(self):
+        """Stop the token refresher and close the shared HTTP client and its pooled connections."""
+        if self._refresh_task is not None and not self._refresh_task.done():
+            self._refresh_task.cancel()
+            # Without the refresher the token can go stale, so re-authenticate on next use
+            self.auth_token = None
+        if _client is not None and not _client.is_closed:
+            await _client.aclose()
+            logger.info("PCloudyAPI HTTP client closed") 
\ No newline at end of file
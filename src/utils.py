@@ -1,22 +1,64 @@
+import asyncio
 import base64
-import json
 import logging
+import mimetypes
+import orjson
+import secrets
 
 logger = logging.getLogger("pcloudy-mcp-server")
 
+MULTIPART_CHUNK_SIZE = 64 * 1024
+
 def encode_auth(username, api_key):
     return base64.b64encode(f"{username}:{api_key}".encode()).decode()
 
 def parse_response(response):
     try:
-        data = response.json()
+        data = orjson.loads(response.content)
         if "result" not in data:
-            logger.error(f"Invalid response format: {json.dumps(data)}")
-            raise ValueError(f"Invalid response format: {json.dumps(data)}")
+            # Report only the top-level keys; error payloads can be very large
+            keys = list(data.keys()) if isinstance(data, dict) else type(data).__name__
+            logger.error("Invalid response format (keys=%s)", keys)
+            error = ValueError("Invalid response format")
+            error.add_note(f"Response keys: {keys}")
+            raise error
         return data["result"]
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         logger.error(f"Invalid JSON response: {response.text}")
         raise ValueError(f"Invalid JSON response: {response.text}")
     except Exception as e:
         logger.error(f"Error parsing response: {str(e)}")
-        raise 
\ No newline at end of file
+        raise
+
+def _quote_multipart_name(value):
+    return value.replace("\\", "\\\\").replace('"', "%22")
+
+def stream_multipart(data, field_name, file_name, file, file_size):
+    """Build a multipart/form-data upload whose file reads run in a worker thread.
+
+    Returns the request headers and an async iterator over the body, so a large
+    file is neither held in memory nor read on the event loop.
+    """
+    boundary = secrets.token_hex(16)
+    content_type = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+    preamble = b"".join(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{_quote_multipart_name(name)}"\r\n\r\n{value}\r\n'.encode()
+        for name, value in data.items()
+    ) + (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{_quote_multipart_name(field_name)}"; '
+        f'filename="{_quote_multipart_name(file_name)}"\r\nContent-Type: {content_type}\r\n\r\n'
+    ).encode()
+    epilogue = f"\r\n--{boundary}--\r\n".encode()
+
+    async def body():
+        yield preamble
+        while chunk := await asyncio.to_thread(file.read, MULTIPART_CHUNK_SIZE):
+            yield chunk
+        yield epilogue
+
+    headers = {
+        "Content-Type": f"multipart/form-data; boundary={boundary}",
+        # An explicit length keeps httpx from falling back to chunked encoding
+        "Content-Length": str(len(preamble) + file_size + len(epilogue))
+    }
+    return headers, body()